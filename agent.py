@@ -1,19 +1,69 @@
 import os
+import re
+import json
+import time
 import asyncio
+import logging
 from typing import List, Dict, Any, Optional
+from collections import deque
+from functools import lru_cache
 from datetime import datetime
 from google import genai
 from google.genai import types
+import numpy as np
 from mcp_client import MCPClientManager
+from cache import LRUCache, SemanticCache, cache_key
+
+try:
+    import orjson
+except ImportError:  # orjson은 선택 의존성 — 없으면 표준 json 사용
+    orjson = None
+
+log = logging.getLogger("agent")
+
+# 히스토리에 저장할 content 최대 길이 — 대형 검색 결과로 인한 메모리 증가 방지
+MAX_CONTENT_LEN = 2048
+
+def _clean_schema_value(schema: Any) -> Any:
+    """JSON Schema에서 Gemini API가 지원하지 않는 필드 제거"""
+    if isinstance(schema, dict):
+        return {
+            key: _clean_schema_value(value)
+            for key, value in schema.items()
+            if key not in ("$schema", "$id", "additionalProperties", "additional_properties")
+        }
+    elif isinstance(schema, list):
+        return [_clean_schema_value(item) for item in schema]
+    else:
+        return schema
+
+@lru_cache(maxsize=256)
+def _normalize_params(params_json: str) -> str:
+    """파라미터 스키마 정리 + object 래핑 — 같은 스키마는 1회만 계산
+
+    MCP 도구 정의는 재연결/Agent 재생성 때마다 동일하게 반복되므로
+    정규화된 JSON 문자열 기준으로 결과를 캐시한다.
+    """
+    p = _clean_schema_value(json.loads(params_json))
+    if isinstance(p, dict) and p.get("type") != "object":
+        p = {"type": "object", "properties": {"arg": p}}
+    return json.dumps(p, sort_keys=True)
 
 class SearchResult:
     """검색 결과를 구조화하여 저장하는 클래스"""
     def __init__(self, source: str, query: str, content: str, metadata: Optional[Dict] = None):
         self.source = source  # "duckduckgo" or "context7"
         self.query = query
-        self.content = content
+        self.content = content[:MAX_CONTENT_LEN]
+        self.content_len = len(content)  # 잘리기 전 원본 길이
         self.metadata = metadata or {}
         self.timestamp = datetime.now()
+        # to_dict마다 isoformat()을 다시 만들지 않도록 미리 계산
+        self._ts_iso = self.timestamp.isoformat()
+        # 히스토리 검색용 토큰 집합 (삽입 시 1회만 계산)
+        self._tokens = frozenset(
+            w for w in re.findall(r"\w+", (query + " " + self.content).lower()) if len(w) > 3
+        )
     
     def to_dict(self):
         return {
@@ -21,59 +71,83 @@ class SearchResult:
             "query": self.query,
             "content": self.content,
             "metadata": self.metadata,
-            "timestamp": self.timestamp.isoformat()
+            "timestamp": self._ts_iso
         }
 
 class Agent:
+    # 한 턴에서 동시에 실행할 도구 호출 수 상한 (MCP 서버 과부하 방지)
+    MAX_TOOL_CONCURRENCY = 8
+    # 도구 호출 1회 제한 시간(초); 타임아웃 시 2배 시간으로 1회 재시도
+    TOOL_TIMEOUT_S = 8
+    # 모델 턴 제한 시간(초) — 모델이 멈춰도 Streamlit 세션이 영원히 붙잡히지 않게
+    MODEL_TIMEOUT_S = 120
+    # 보관할 검색 히스토리 최대 건수 (초과분은 오래된 것부터 제거)
+    HISTORY_MAXLEN = 200
+    # 여러 도구 호출을 모델 턴 1회로 묶는 메타 도구 이름
+    EXECUTE_PLAN_TOOL = "execute_plan"
+    # 시스템 프롬프트/도구 선언을 서버 측에 캐시해두는 시간(초)
+    CACHED_CONTENT_TTL_S = 3600
+    # 시맨틱 캐시 적재용 임베딩을 모아 보내는 플러시 간격(초)
+    EMBED_FLUSH_INTERVAL_S = 0.05
+
     def __init__(self, mcp_client: MCPClientManager):
         self.mcp_client = mcp_client
         self.model_name = "gemini-2.5-pro"
         self.client = None
         self.chat = None
-        self.search_history: List[SearchResult] = []
+        self.search_history: deque[SearchResult] = deque(maxlen=self.HISTORY_MAXLEN)
+        # 토큰 → 히스토리 순번(seq) 역색인 (히스토리 전체 스캔 방지)
+        self._history_index: Dict[str, List[int]] = {}
+        # 지금까지 히스토리에 추가된 총 건수 — deque 축출 후에도 seq가 유효하도록
+        self._history_seq = 0
+        self.temperature = 0.7
+        # 동일한 프롬프트 반복 시 모델 호출을 생략하기 위한 응답 캐시
+        self._cache = LRUCache(maxsize=512, ttl=3600)
+        # 비슷하게 바꿔 쓴 질문도 재사용할 수 있는 임베딩 기반 캐시
+        self._semantic_cache = SemanticCache(maxsize=256, ttl=3600, threshold=0.92)
+        self.embedding_model = "text-embedding-004"
+        # 임베딩 배치 적재 큐 (여러 건을 embed_content 1회로 묶음)
+        self._embed_queue: Optional[asyncio.Queue] = None
+        self._embed_task: Optional[asyncio.Task] = None
+        # (도구 정의 시그니처, 변환된 Tool 목록) — 도구가 바뀌지 않으면 재변환 생략
+        self._tools_cache: Optional[tuple] = None
+        # 도구 이름 → 출처 분류 (start_chat에서 1회 구성)
+        self._tool_source: Dict[str, str] = {}
+        # 서버 측 캐시된 시스템 프롬프트 (사용 불가 환경이면 None으로 유지)
+        self._cached_content = None
+        self._cached_content_expires = 0.0
         self._configure_genai()
 
     def _configure_genai(self):
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
-            print("Warning: GOOGLE_API_KEY not set.")
+            log.warning("GOOGLE_API_KEY not set.")
         else:
             self.client = genai.Client(api_key=api_key)
 
     def _clean_schema(self, schema: Any) -> Any:
         """JSON Schema에서 Gemini API가 지원하지 않는 필드 제거"""
-        if isinstance(schema, dict):
-            # 복사본 생성
-            cleaned = {}
-            for key, value in schema.items():
-                # 지원하지 않는 필드 제거
-                if key in ["$schema", "$id", "additionalProperties", "additional_properties"]:
-                    continue
-                # 재귀적으로 정리
-                cleaned[key] = self._clean_schema(value)
-            return cleaned
-        elif isinstance(schema, list):
-            return [self._clean_schema(item) for item in schema]
-        else:
-            return schema
+        return _clean_schema_value(schema)
 
     def _get_tools(self):
         """Convert MCP tools to google-genai Tool objects"""
         mcp_tools = self.mcp_client.get_tools_for_gemini()
+
+        # 도구 정의가 그대로면 이전에 변환한 결과 재사용
+        sig = hash(tuple((t["name"], t["description"]) for t in mcp_tools))
+        if self._tools_cache and self._tools_cache[0] == sig:
+            return self._tools_cache[1]
+
         function_declarations = []
         
         for tool in mcp_tools:
-            parameters = tool["parameters"].copy() if isinstance(tool["parameters"], dict) else tool["parameters"]
-            
-            # Gemini API가 지원하지 않는 필드 제거 (재귀적으로)
+            parameters = tool["parameters"]
+
+            # 정리 + object 래핑은 스키마별로 캐시된 순수 함수에 위임
             if isinstance(parameters, dict):
-                parameters = self._clean_schema(parameters)
-            
-            if isinstance(parameters, dict) and parameters.get("type") != "object":
-                 parameters = {
-                     "type": "object",
-                     "properties": {"arg": parameters}
-                 }
+                parameters = json.loads(
+                    _normalize_params(json.dumps(parameters, sort_keys=True))
+                )
 
             func_decl = types.FunctionDeclaration(
                 name=tool["name"],
@@ -84,23 +158,214 @@ class Agent:
             
         if not function_declarations:
             return None
-            
-        return [types.Tool(function_declarations=function_declarations)]
+
+        # 도구가 하나라도 있으면 묶음 실행용 메타 도구도 함께 노출
+        function_declarations.append(self._plan_tool_declaration())
+        tools = [types.Tool(function_declarations=function_declarations)]
+        self._tools_cache = (sig, tools)
+        return tools
+
+    def _plan_tool_declaration(self) -> types.FunctionDeclaration:
+        """execute_plan 메타 도구 선언 — 도구 시퀀스를 한 턴에 실행"""
+        return types.FunctionDeclaration(
+            name=self.EXECUTE_PLAN_TOOL,
+            description=(
+                "Execute a sequence of tool calls in a single step instead of one "
+                "call per turn. Use this when you already know the next tools and "
+                "their arguments, e.g. resolve a library ID then fetch its docs. "
+                "Each step is {\"tool\": name, \"args\": {...}, \"bind_output_to\": "
+                "optional label}; a later step may reference an earlier output by "
+                "passing \"$label\" as a string argument value."
+            ),
+            parameters={
+                "type": "object",
+                "properties": {
+                    "steps": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "tool": {"type": "string", "description": "Tool name to call"},
+                                "args": {"type": "object", "description": "Arguments for the tool"},
+                                "bind_output_to": {"type": "string", "description": "Label to store this step's output under"}
+                            },
+                            "required": ["tool"]
+                        }
+                    }
+                },
+                "required": ["steps"]
+            }
+        )
+
+    @staticmethod
+    def _has_output_ref(value: Any) -> bool:
+        """args 안에 이전 단계 출력 참조($label)가 있는지 확인"""
+        if isinstance(value, str):
+            return value.startswith("$")
+        if isinstance(value, dict):
+            return any(Agent._has_output_ref(v) for v in value.values())
+        if isinstance(value, list):
+            return any(Agent._has_output_ref(v) for v in value)
+        return False
+
+    async def _execute_plan(self, steps: List[Dict], tool_semaphore: asyncio.Semaphore,
+                            collected: List[SearchResult], sources: set) -> str:
+        """계획된 도구 시퀀스를 실행하고 결합된 결과 문자열 반환
+
+        이전 출력 참조가 없는 연속 단계는 asyncio.gather로 병렬 실행하고,
+        참조가 있는 단계는 앞 단계 완료 후 순차 실행한다.
+        """
+        outputs: Dict[str, str] = {}
+        result_lines: List[str] = []
+
+        def substitute(value: Any) -> Any:
+            if isinstance(value, str) and value.startswith("$"):
+                return outputs.get(value[1:], value)
+            if isinstance(value, dict):
+                return {k: substitute(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [substitute(v) for v in value]
+            return value
+
+        async def run_one(step: Dict):
+            tool_name = step.get("tool", "")
+            args = substitute(step.get("args") or {})
+            try:
+                async with tool_semaphore:
+                    tool_result = await asyncio.wait_for(
+                        self.mcp_client.call_tool(tool_name, args),
+                        timeout=self.TOOL_TIMEOUT_S * 2
+                    )
+            except Exception as e:
+                return step, f"Error executing tool {tool_name}: {str(e)}"
+            source = self._tool_source.get(tool_name, "unknown")
+            if isinstance(args, dict):
+                query = args.get("query") or args.get("text")
+                if query is None:
+                    query = str(args)
+            else:
+                query = str(args)
+            collected.append(SearchResult(
+                source=source,
+                query=query,
+                content=tool_result,
+                metadata={"tool": tool_name, "args": args, "plan": True}
+            ))
+            sources.add(source)
+            return step, tool_result
+
+        def record(step: Dict, output: str):
+            label = step.get("bind_output_to")
+            if label:
+                outputs[label] = output
+            result_lines.append(f"[{step.get('tool', '?')}]\n{output}")
+
+        batch: List[Dict] = []
+
+        async def flush():
+            if not batch:
+                return
+            for step, output in await asyncio.gather(*(run_one(s) for s in batch)):
+                record(step, output)
+            batch.clear()
+
+        for step in steps:
+            if self._has_output_ref(step.get("args")):
+                # 이전 출력에 의존 — 앞 배치를 끝낸 뒤 순차 실행
+                await flush()
+                step_done, output = await run_one(step)
+                record(step_done, output)
+            else:
+                batch.append(step)
+        await flush()
+
+        return "\n\n".join(result_lines) if result_lines else "Error: empty plan"
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """텍스트 임베딩 생성 (실패 시 None 반환하여 캐시만 건너뜀)"""
+        if not self.client:
+            return None
+        try:
+            result = self.client.models.embed_content(
+                model=self.embedding_model,
+                contents=text
+            )
+            return np.asarray(result.embeddings[0].values, dtype=np.float32)
+        except Exception as e:
+            log.warning("Embedding failed: %s", e)
+            return None
+
+    def _embed_many(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """여러 텍스트를 한 번의 embed_content 호출로 임베딩"""
+        if not self.client or not texts:
+            return None
+        try:
+            result = self.client.models.embed_content(
+                model=self.embedding_model,
+                contents=texts
+            )
+            return [np.asarray(e.values, dtype=np.float32) for e in result.embeddings]
+        except Exception as e:
+            log.warning("Batch embedding failed: %s", e)
+            return None
+
+    def _queue_semantic_add(self, query: str, answer: str):
+        """시맨틱 캐시 적재를 배치 큐에 넣는다 — 플러시 태스크가 한 번에 임베딩"""
+        if self._embed_queue is None:
+            self._embed_queue = asyncio.Queue()
+        self._embed_queue.put_nowait((query, answer))
+        if self._embed_task is None or self._embed_task.done():
+            self._embed_task = asyncio.ensure_future(self._flush_embed_queue())
+
+    async def _flush_embed_queue(self):
+        """플러시 간격 동안 모인 항목을 임베딩 1회로 묶어 캐시에 반영"""
+        await asyncio.sleep(self.EMBED_FLUSH_INTERVAL_S)
+        pending = []
+        while self._embed_queue is not None and not self._embed_queue.empty():
+            pending.append(self._embed_queue.get_nowait())
+        if not pending:
+            return
+        embeddings = await asyncio.to_thread(self._embed_many, [q for q, _ in pending])
+        if embeddings is None:
+            return
+        for (query, answer), embedding in zip(pending, embeddings):
+            self._semantic_cache.add(embedding, query, answer)
+
+    def _remember_results(self, results: List[SearchResult]):
+        """검색 결과를 히스토리에 추가하고 역색인 갱신"""
+        for result in results:
+            seq = self._history_seq
+            self._history_seq += 1
+            self.search_history.append(result)
+            oldest = self._history_seq - len(self.search_history)
+            for token in result._tokens:
+                entries = self._history_index.setdefault(token, [])
+                entries.append(seq)
+                # 축출된 항목의 seq는 이 기회에 정리
+                while entries and entries[0] < oldest:
+                    entries.pop(0)
 
     def _get_relevant_history(self, query: str, max_results: int = 3) -> str:
         """검색 히스토리에서 관련된 결과를 찾아 반환"""
         if not self.search_history:
             return ""
-        
-        query_lower = query.lower()
+
+        qtoks = {w for w in query.lower().split() if len(w) > 3}
+        if not qtoks:
+            return ""
+
+        # 역색인에서 후보만 모아 최신 순으로 확인 (최근 10건 범위 유지)
+        candidates = set().union(*(self._history_index.get(t, ()) for t in qtoks))
+        oldest = self._history_seq - len(self.search_history)
+        window_start = self._history_seq - 10
         relevant = []
-        for result in reversed(self.search_history[-10:]):
-            if any(word in result.query.lower() or word in result.content.lower() 
-                   for word in query_lower.split() if len(word) > 3):
-                relevant.append(result)
-                if len(relevant) >= max_results:
-                    break
-        
+        for seq in sorted(candidates, reverse=True):
+            if seq < max(window_start, oldest):
+                break
+            relevant.append(self.search_history[seq - oldest])
+            if len(relevant) >= max_results:
+                break
+
         if not relevant:
             return ""
         
@@ -112,6 +377,12 @@ class Agent:
 
     def start_chat(self):
         tools = self._get_tools()
+
+        # 도구별 출처 분류를 한 번만 계산해두고 호출 때마다 dict 조회
+        self._tool_source = {
+            t["name"]: ("duckduckgo" if "duckduckgo" in t["server"].lower() else "context7")
+            for t in self.mcp_client.tools
+        }
         
         system_instruction = """You are an intelligent search agent specialized in helping developers.
 
@@ -150,30 +421,80 @@ Guidelines:
 - Synthesize all results into a coherent, well-cited answer
 - If information is incomplete, indicate what's missing and suggest follow-up searches"""
 
-        self.chat = self.client.chats.create(
-            model=self.model_name,
-            config=types.GenerateContentConfig(
+        # 시스템 프롬프트 + 도구 선언을 서버 측에 캐시해서 턴마다 프리필 토큰 절약
+        self._cached_content = None
+        try:
+            self._cached_content = self.client.caches.create(
+                model=self.model_name,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    tools=tools,
+                    ttl=f"{self.CACHED_CONTENT_TTL_S}s"
+                )
+            )
+            self._cached_content_expires = time.monotonic() + self.CACHED_CONTENT_TTL_S
+        except Exception as e:
+            log.warning("Cached content unavailable, sending prompt inline: %s", e)
+
+        if self._cached_content:
+            config = types.GenerateContentConfig(
+                cached_content=self._cached_content.name,
+                temperature=self.temperature
+            )
+        else:
+            config = types.GenerateContentConfig(
                 tools=tools,
                 system_instruction=system_instruction,
-                temperature=0.7
+                temperature=self.temperature
             )
+
+        self.chat = self.client.chats.create(
+            model=self.model_name,
+            config=config
         )
 
-    async def process_message(self, user_message: str):
+    def _ensure_chat(self):
+        """채팅 세션 준비 — 서버 측 프롬프트 캐시가 만료됐으면 재생성"""
+        if self.chat and self._cached_content and time.monotonic() > self._cached_content_expires:
+            # TTL 만료: 새 캐시로 세션을 다시 연다 (대화 컨텍스트는 초기화됨)
+            self.chat = None
         if not self.chat:
             self.start_chat()
 
+    async def process_message(self, user_message: str):
+        self._ensure_chat()
+
         history_context = self._get_relevant_history(user_message)
         enhanced_message = user_message
         if history_context:
             enhanced_message = f"{user_message}\n\n{history_context}\n\nNote: Use previous search results if relevant, but also perform new searches if needed."
 
-        # google-genai SDK의 send_message는 동기 메서드
-        response = self.chat.send_message(enhanced_message)
+        # 동일한 (모델, 메시지, 도구, 온도) 조합이면 캐시된 응답 반환
+        tool_names = [t["name"] for t in self.mcp_client.get_tools_for_gemini()]
+        key = cache_key(self.model_name, enhanced_message, tool_names, self.temperature)
+        cached_response = self._cache.get(key)
+        if cached_response is not None:
+            return cached_response
+
+        # 의미상 거의 같은 질문이면 이전 최종 답변 재사용 (툴 루프 전체 생략)
+        # embed_content는 동기 API — 이벤트 루프를 막지 않도록 스레드로 넘긴다
+        query_embedding = await asyncio.to_thread(self._embed, user_message)
+        if query_embedding is not None:
+            semantic_hit = self._semantic_cache.lookup(query_embedding)
+            if semantic_hit is not None:
+                return semantic_hit
+
+        # google-genai SDK의 send_message는 동기 메서드 — 스레드로 넘기고 제한 시간을 둔다
+        response = await asyncio.wait_for(
+            asyncio.to_thread(self.chat.send_message, enhanced_message),
+            timeout=self.MODEL_TIMEOUT_S
+        )
         
         max_turns = 15
         current_turn = 0
         search_results_this_query: List[SearchResult] = []
+        sources_this_query: set = set()  # append 시점에 같이 채워 재스캔 방지
+        tool_semaphore = asyncio.Semaphore(self.MAX_TOOL_CONCURRENCY)
 
         while current_turn < max_turns:
             if not response.candidates:
@@ -181,20 +502,24 @@ Guidelines:
             
             candidate = response.candidates[0]
             
-            function_calls = []
-            for part in candidate.content.parts:
-                if part.function_call:
-                    function_calls.append(part.function_call)
-            
+            function_calls = [p.function_call for p in candidate.content.parts if p.function_call]
+
             if not function_calls:
                 if search_results_this_query:
-                    self.search_history.extend(search_results_this_query)
+                    self._remember_results(search_results_this_query)
                     final_response = response.text
-                    sources = set(r.source for r in search_results_this_query)
-                    source_note = "\n\n---\n*Sources: " + ", ".join(sources) + "*"
+                    source_note = "\n\n---\n*Sources: " + ", ".join(sources_this_query) + "*"
                     final_response += source_note
+                    self._cache.set(key, final_response)
+                    if query_embedding is not None:
+                        self._semantic_cache.add(query_embedding, user_message, final_response)
+                    else:
+                        # 조회 시 임베딩이 실패했으면 배치 큐를 통해 나중에 적재
+                        self._queue_semantic_add(user_message, final_response)
                     return final_response
-                
+
+                if response.text:
+                    self._cache.set(key, response.text)
                 return response.text
 
             # 여러 도구를 병렬로 실행하여 속도 향상
@@ -202,17 +527,35 @@ Guidelines:
                 tool_name = fc.name
                 args = fc.args
                 
-                print(f"[INFO] Executing tool: {tool_name} with args: {args}")
-                
-                try:
-                    # 타임아웃 설정 (30초)
-                    tool_result = await asyncio.wait_for(
-                        self.mcp_client.call_tool(tool_name, args),
-                        timeout=30.0
+                # %-포맷으로 지연 포매팅 — 로거가 꺼져 있으면 args repr 비용이 없다
+                log.debug("tool %s args=%r", tool_name, args)
+
+                # 메타 도구: 계획된 시퀀스를 모델 턴 1회로 실행
+                if tool_name == self.EXECUTE_PLAN_TOOL:
+                    formatted = await self._execute_plan(
+                        list(args.get("steps") or []), tool_semaphore,
+                        search_results_this_query, sources_this_query
                     )
+                    return tool_name, formatted, None, None
+
+                try:
+                    # 짧은 타임아웃 + 1회 재시도로 꼬리 지연 제한, 동시 실행 수는 세마포어로 제한
+                    async with tool_semaphore:
+                        try:
+                            tool_result = await asyncio.wait_for(
+                                self.mcp_client.call_tool(tool_name, args),
+                                timeout=self.TOOL_TIMEOUT_S
+                            )
+                        except asyncio.TimeoutError:
+                            tool_result = await asyncio.wait_for(
+                                self.mcp_client.call_tool(tool_name, args),
+                                timeout=self.TOOL_TIMEOUT_S * 2
+                            )
                     
-                    source = "duckduckgo" if "duckduckgo" in tool_name.lower() else "context7"
-                    query = args.get("query", args.get("text", str(args)))
+                    source = self._tool_source.get(tool_name, "unknown")
+                    query = args.get("query") or args.get("text")
+                    if query is None:
+                        query = str(args)
                     
                     search_result = SearchResult(
                         source=source,
@@ -225,12 +568,12 @@ Guidelines:
                     return tool_name, formatted_result, search_result, None
                     
                 except asyncio.TimeoutError:
-                    error_msg = f"Tool {tool_name} execution timeout (30s)"
-                    print(f"[ERROR] {error_msg}")
+                    error_msg = f"Tool {tool_name} execution timeout ({self.TOOL_TIMEOUT_S * 2}s after retry)"
+                    log.error("%s", error_msg)
                     return tool_name, f"Error: {error_msg}", None, error_msg
                 except Exception as e:
                     error_msg = f"Error executing tool {tool_name}: {str(e)}"
-                    print(f"[ERROR] Tool execution error: {e}")
+                    log.error("Tool execution error: %s", e)
                     return tool_name, error_msg, None, str(e)
             
             # 모든 도구를 병렬로 실행
@@ -239,13 +582,14 @@ Guidelines:
             function_responses = []
             for result in tool_results:
                 if isinstance(result, Exception):
-                    print(f"[ERROR] Tool execution exception: {result}")
+                    log.error("Tool execution exception: %s", result)
                     continue
                 
                 tool_name, formatted_result, search_result, error = result
                 
                 if search_result:
                     search_results_this_query.append(search_result)
+                    sources_this_query.add(search_result.source)
                 
                 # FunctionResponse 생성
                 function_responses.append(
@@ -262,21 +606,231 @@ Guidelines:
             
             # google-genai SDK의 send_message는 동기 메서드
             # Part 리스트를 직접 전달
-            response = self.chat.send_message(function_response_parts)
+            response = await asyncio.wait_for(
+                asyncio.to_thread(self.chat.send_message, function_response_parts),
+                timeout=self.MODEL_TIMEOUT_S
+            )
             current_turn += 1
 
         if search_results_this_query:
-            self.search_history.extend(search_results_this_query)
+            self._remember_results(search_results_this_query)
             final_text = response.text if hasattr(response, 'text') else "Maximum tool execution turns reached."
-            sources = set(r.source for r in search_results_this_query)
-            return f"{final_text}\n\n---\n*Sources: {', '.join(sources)}*"
+            return f"{final_text}\n\n---\n*Sources: {', '.join(sources_this_query)}*"
         
         return "Error: Maximum tool execution turns reached."
 
+    async def _stream_model_turn(self, message):
+        """동기 send_message_stream을 워커 스레드에서 소비해 청크를 비동기로 산출
+
+        스트림이 중간에 멈춰도 이벤트 루프가 막히지 않고, send_message와
+        동일하게 턴 전체에 MODEL_TIMEOUT_S 데드라인 하나를 적용한다.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        end = object()
+
+        def pump():
+            try:
+                for chunk in self.chat.send_message_stream(message):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except BaseException as e:
+                # 워커의 예외는 큐로 전달해 소비자 쪽에서 다시 던진다
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+                return
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+        loop.run_in_executor(None, pump)
+        deadline = loop.time() + self.MODEL_TIMEOUT_S
+        while True:
+            item = await asyncio.wait_for(queue.get(), timeout=deadline - loop.time())
+            if item is end:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def process_message_stream(self, user_message: str):
+        """process_message의 스트리밍 버전 — 최종 턴의 텍스트를 델타로 산출
+
+        도구 호출 턴은 내부에서 소화하고, 사용자에게 보일 텍스트만
+        도착하는 대로 yield하여 체감 첫 토큰 시간을 줄인다.
+        """
+        self._ensure_chat()
+
+        history_context = self._get_relevant_history(user_message)
+        enhanced_message = user_message
+        if history_context:
+            enhanced_message = f"{user_message}\n\n{history_context}\n\nNote: Use previous search results if relevant, but also perform new searches if needed."
+
+        # 캐시 적중 시 전체 답변을 한 번에 산출
+        tool_names = [t["name"] for t in self.mcp_client.get_tools_for_gemini()]
+        key = cache_key(self.model_name, enhanced_message, tool_names, self.temperature)
+        cached_response = self._cache.get(key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        query_embedding = await asyncio.to_thread(self._embed, user_message)
+        if query_embedding is not None:
+            semantic_hit = self._semantic_cache.lookup(query_embedding)
+            if semantic_hit is not None:
+                yield semantic_hit
+                return
+
+        max_turns = 15
+        search_results_this_query: List[SearchResult] = []
+        sources_this_query: set = set()  # append 시점에 같이 채워 재스캔 방지
+        tool_semaphore = asyncio.Semaphore(self.MAX_TOOL_CONCURRENCY)
+        accumulated_text = ""
+        message = enhanced_message
+
+        for _ in range(max_turns):
+            function_calls = []
+
+            # 동기 스트림은 워커 스레드에서 소비 — 루프 비차단 + 턴 단위 타임아웃
+            async for chunk in self._stream_model_turn(message):
+                if not chunk.candidates:
+                    continue
+                for part in chunk.candidates[0].content.parts or []:
+                    if part.function_call:
+                        function_calls.append(part.function_call)
+                    elif part.text and not function_calls:
+                        # 캐시에 저장되는 값과 사용자가 본 스트림이 일치하도록
+                        # yield한 텍스트만 그대로 누적한다
+                        yield part.text
+                        accumulated_text += part.text
+
+            if not function_calls:
+                if search_results_this_query:
+                    self._remember_results(search_results_this_query)
+                    source_note = "\n\n---\n*Sources: " + ", ".join(sources_this_query) + "*"
+                    yield source_note
+                    accumulated_text += source_note
+                    self._cache.set(key, accumulated_text)
+                    if query_embedding is not None:
+                        self._semantic_cache.add(query_embedding, user_message, accumulated_text)
+                    else:
+                        # 조회 시 임베딩이 실패했으면 배치 큐를 통해 나중에 적재
+                        self._queue_semantic_add(user_message, accumulated_text)
+                elif accumulated_text:
+                    self._cache.set(key, accumulated_text)
+                return
+
+            # 도구 호출 턴: process_message와 동일하게 병렬 실행 후 다음 턴으로
+            async def execute_tool(fc):
+                tool_name = fc.name
+                args = fc.args
+
+                # 메타 도구: 계획된 시퀀스를 모델 턴 1회로 실행
+                if tool_name == self.EXECUTE_PLAN_TOOL:
+                    formatted = await self._execute_plan(
+                        list(args.get("steps") or []), tool_semaphore,
+                        search_results_this_query, sources_this_query
+                    )
+                    return tool_name, formatted, None
+
+                try:
+                    async with tool_semaphore:
+                        try:
+                            tool_result = await asyncio.wait_for(
+                                self.mcp_client.call_tool(tool_name, args),
+                                timeout=self.TOOL_TIMEOUT_S
+                            )
+                        except asyncio.TimeoutError:
+                            tool_result = await asyncio.wait_for(
+                                self.mcp_client.call_tool(tool_name, args),
+                                timeout=self.TOOL_TIMEOUT_S * 2
+                            )
+                    source = self._tool_source.get(tool_name, "unknown")
+                    query = args.get("query") or args.get("text")
+                    if query is None:
+                        query = str(args)
+                    search_result = SearchResult(
+                        source=source,
+                        query=query,
+                        content=tool_result,
+                        metadata={"tool": tool_name, "args": args}
+                    )
+                    return tool_name, f"[Source: {source.upper()}]\n{tool_result}", search_result
+                except asyncio.TimeoutError:
+                    return tool_name, f"Error: Tool {tool_name} execution timeout ({self.TOOL_TIMEOUT_S * 2}s after retry)", None
+                except Exception as e:
+                    return tool_name, f"Error executing tool {tool_name}: {str(e)}", None
+
+            tool_results = await asyncio.gather(
+                *[execute_tool(fc) for fc in function_calls], return_exceptions=True
+            )
+
+            function_responses = []
+            for result in tool_results:
+                if isinstance(result, Exception):
+                    log.error("Tool execution exception: %s", result)
+                    continue
+                tool_name, formatted_result, search_result = result
+                if search_result:
+                    search_results_this_query.append(search_result)
+                    sources_this_query.add(search_result.source)
+                function_responses.append(
+                    types.FunctionResponse(
+                        name=tool_name,
+                        response={"result": formatted_result}
+                    )
+                )
+
+            message = [types.Part(function_response=fr) for fr in function_responses]
+
+        if search_results_this_query:
+            self._remember_results(search_results_this_query)
+            yield "\n\n---\n*Sources: " + ", ".join(sources_this_query) + "*"
+        else:
+            yield "Error: Maximum tool execution turns reached."
+
+    async def process_batch(self, messages: List[str], poll_interval: float = 10.0) -> List[str]:
+        """여러 독립 프롬프트를 Gemini Batch API로 처리 (토큰당 약 50% 저렴, 실시간 아님)
+
+        도구 호출 없이 모델 응답만 필요한 대량 작업용.
+        메시지가 1개뿐이면 호출부에서 process_message를 쓰는 것이 맞다.
+        """
+        if not self.client:
+            return ["Error: GOOGLE_API_KEY not set."] * len(messages)
+
+        src = [
+            {"contents": [{"role": "user", "parts": [{"text": m}]}]}
+            for m in messages
+        ]
+        job = await asyncio.to_thread(
+            self.client.batches.create, model=self.model_name, src=src
+        )
+
+        # 완료될 때까지 폴링
+        terminal_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED"}
+        while job.state.name not in terminal_states:
+            await asyncio.sleep(poll_interval)
+            job = await asyncio.to_thread(self.client.batches.get, name=job.name)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            return [f"Error: batch job ended in state {job.state.name}"] * len(messages)
+
+        results = []
+        for inline in job.dest.inlined_responses:
+            if inline.response is not None:
+                results.append(inline.response.text or "")
+            else:
+                results.append(f"Error: {inline.error}")
+        return results
+
     def get_search_history(self) -> List[Dict]:
         """검색 히스토리를 딕셔너리 리스트로 반환"""
         return [result.to_dict() for result in self.search_history]
 
+    def export_history_json(self) -> str:
+        """검색 히스토리를 JSON 문자열로 직렬화 (orjson이 있으면 사용)"""
+        history = self.get_search_history()
+        if orjson is not None:
+            return orjson.dumps(history).decode()
+        return json.dumps(history, ensure_ascii=False)
+
     def clear_history(self):
         """검색 히스토리 초기화"""
         self.search_history.clear()
+        self._history_index.clear()
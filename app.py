@@ -1,60 +1,47 @@
 import streamlit as st
 import asyncio
-import nest_asyncio
 from dotenv import load_dotenv
-from mcp_client import MCPClientManager
+from mcp_client import MCPClientManager, get_manager
 from agent import Agent
 
-# Load environment variables
-load_dotenv()
+@st.cache_resource
+def _bootstrap():
+    """rerun마다 반복할 필요 없는 초기화 — 세션당 1회만 실행"""
+    # Load environment variables
+    load_dotenv()
+    return True
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
+@st.cache_resource
+def _get_mcp_client() -> MCPClientManager:
+    """rerun 간에 동일한 MCP 클라이언트 싱글턴 재사용 (프로세스 전역과 공유)"""
+    return get_manager()
 
-st.set_page_config(page_title="Gemini MCP Agent", page_icon="🤖", layout="wide")
+@st.cache_data
+def _tool_lines(signatures: tuple) -> list:
+    """도구 목록 표시 문자열 — 도구가 바뀌지 않으면 재생성하지 않음"""
+    return [f"{name} ({server})" for name, server in signatures]
 
-async def main():
-    st.title("🔍 지능형 검색 에이전트")
-    st.caption("Powered by Gemini 2.5 Pro, DuckDuckGo, and Context7")
+@st.fragment
+def _render_sidebar():
+    """사이드바 전용 fragment — 채팅 입력 rerun에 사이드바 재구성 비용이 실리지 않도록 분리
 
-    # Initialize Session State
-    if "mcp_client" not in st.session_state:
-        st.session_state.mcp_client = MCPClientManager()
-        st.session_state.agent = None
-        st.session_state.messages = []
-        st.session_state.connected = False
-
-    # Sidebar for connection management
+    fragment 안에서는 await할 수 없으므로 연결/해제 버튼은 플래그만 세우고
+    실제 비동기 작업은 main()의 본 실행 경로에서 처리한다.
+    """
     with st.sidebar:
         st.header("System Status")
-        
+
         if not st.session_state.connected:
             st.warning("🔴 Disconnected")
             if st.button("Connect to MCP Servers", type="primary"):
-                with st.spinner("Connecting to DuckDuckGo & Context7..."):
-                    try:
-                        await st.session_state.mcp_client.connect()
-                        st.session_state.agent = Agent(st.session_state.mcp_client)
-                        st.session_state.connected = True
-                        
-                        # 연결 상태 표시
-                        connected_servers = list(st.session_state.mcp_client.sessions.keys())
-                        if len(connected_servers) == 2:
-                            st.success("✅ Connected to all servers!")
-                        else:
-                            st.warning(f"⚠️ Connected to: {', '.join(connected_servers)}")
-                            if st.session_state.mcp_client.connection_errors:
-                                with st.expander("Connection Errors"):
-                                    for server, error in st.session_state.mcp_client.connection_errors.items():
-                                        st.error(f"**{server}**: {error}")
-                        
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Connection failed: {e}")
-                        if hasattr(st.session_state.mcp_client, 'connection_errors'):
-                            with st.expander("Detailed Error Information"):
-                                for server, error in st.session_state.mcp_client.connection_errors.items():
-                                    st.error(f"**{server}**: {error}")
+                st.session_state.pending_connect = True
+                st.rerun()
+            if st.session_state.get("connect_error"):
+                st.error(f"Connection failed: {st.session_state.connect_error}")
+                if st.session_state.mcp_client.connection_errors:
+                    with st.expander("Detailed Error Information"):
+                        for server, error in st.session_state.mcp_client.connection_errors.items():
+                            st.error(f"**{server}**: {error}")
         else:
             # 연결된 서버 표시
             connected_servers = list(st.session_state.mcp_client.sessions.keys())
@@ -62,27 +49,42 @@ async def main():
                 st.success("🟢 Connected to all servers")
             else:
                 st.warning(f"⚠️ Connected to: {', '.join(connected_servers)}")
-            
+
             st.info(f"Loaded Tools: {len(st.session_state.mcp_client.tools)}")
             with st.expander("View Tools"):
                 if st.session_state.mcp_client.tools:
-                    for tool in st.session_state.mcp_client.tools:
-                        st.code(f"{tool['name']} ({tool['server']})")
+                    signatures = tuple(
+                        (t["name"], t["server"]) for t in st.session_state.mcp_client.tools
+                    )
+                    for line in _tool_lines(signatures):
+                        st.code(line)
                 else:
                     st.warning("No tools available")
-            
+
             # 연결 에러가 있으면 표시
-            if hasattr(st.session_state.mcp_client, 'connection_errors') and st.session_state.mcp_client.connection_errors:
+            if st.session_state.mcp_client.connection_errors:
                 with st.expander("⚠️ Connection Warnings"):
                     for server, error in st.session_state.mcp_client.connection_errors.items():
                         st.error(f"**{server}**: {error}")
-            
+
+            # 배치 모드: 여러 줄 입력을 Gemini Batch API로 처리 (저렴하지만 느림)
+            st.checkbox(
+                "Run as batch (cheaper, slower)",
+                key="batch_mode",
+                help="입력을 줄 단위로 나눠 Gemini Batch API로 처리합니다. 한 줄이면 일반 모드로 동작합니다."
+            )
+
+            # LLM 응답 캐시 상태 표시
+            if st.session_state.agent:
+                cache = st.session_state.agent._cache
+                st.caption(f"LLM cache: {cache.hits} hits / {cache.misses} misses ({len(cache)} entries)")
+
             # Search History
             if st.session_state.agent and hasattr(st.session_state.agent, 'search_history'):
                 history = st.session_state.agent.get_search_history()
                 if history:
                     st.subheader("📚 Search History")
-                    st.info(f"Total searches: {len(history)}")
+                    st.info(f"Searches kept: {len(history)} (max {Agent.HISTORY_MAXLEN})")
                     with st.expander("View Search History"):
                         for i, result in enumerate(reversed(history[-10:]), 1):
                             st.markdown(f"**{i}. {result['source'].upper()}** - `{result['query']}`")
@@ -90,13 +92,47 @@ async def main():
                     if st.button("Clear History"):
                         st.session_state.agent.clear_history()
                         st.rerun()
-            
+
             if st.button("Disconnect"):
-                await st.session_state.mcp_client.cleanup()
-                st.session_state.connected = False
-                st.session_state.agent = None
+                st.session_state.pending_disconnect = True
                 st.rerun()
 
+_bootstrap()
+
+st.set_page_config(page_title="Gemini MCP Agent", page_icon="🤖", layout="wide")
+
+async def main():
+    st.title("🔍 지능형 검색 에이전트")
+    st.caption("Powered by Gemini 2.5 Pro, DuckDuckGo, and Context7")
+
+    # Initialize Session State
+    if "mcp_client" not in st.session_state:
+        st.session_state.mcp_client = _get_mcp_client()
+        st.session_state.agent = None
+        st.session_state.messages = []
+        st.session_state.connected = False
+
+    # 사이드바 버튼이 세운 플래그에 대한 비동기 작업 처리
+    if st.session_state.get("pending_connect"):
+        st.session_state.pending_connect = False
+        with st.spinner("Connecting to DuckDuckGo & Context7..."):
+            try:
+                await st.session_state.mcp_client.ensure_connected()
+                st.session_state.agent = Agent(st.session_state.mcp_client)
+                st.session_state.connected = True
+                st.session_state.connect_error = None
+            except Exception as e:
+                st.session_state.connect_error = str(e)
+
+    if st.session_state.get("pending_disconnect"):
+        st.session_state.pending_disconnect = False
+        await st.session_state.mcp_client.cleanup()
+        st.session_state.connected = False
+        st.session_state.agent = None
+
+    # Sidebar for connection management (fragment로 분리되어 독립적으로 rerun)
+    _render_sidebar()
+
     # Chat Interface
     for msg in st.session_state.messages:
         with st.chat_message(msg["role"]):
@@ -117,12 +153,27 @@ async def main():
                 message_placeholder = st.empty()
                 with st.spinner("Thinking..."):
                     try:
-                        response = await st.session_state.agent.process_message(prompt)
+                        batch_prompts = [p.strip() for p in prompt.splitlines() if p.strip()]
+                        if st.session_state.get("batch_mode") and len(batch_prompts) > 1:
+                            responses = await st.session_state.agent.process_batch(batch_prompts)
+                            response = "\n\n---\n\n".join(responses)
+                        else:
+                            # 응답을 도착하는 대로 스트리밍 표시
+                            response = ""
+                            async for delta in st.session_state.agent.process_message_stream(prompt):
+                                response += delta
+                                message_placeholder.markdown(response + "▌")
                         message_placeholder.markdown(response)
                         st.session_state.messages.append({"role": "assistant", "content": response})
                     except Exception as e:
                         st.error(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # rerun마다 루프를 새로 만들지 않고 세션에 하나를 유지 —
+    # MCP 전송/커넥션 풀이 rerun을 넘어 살아남는다
+    if "loop" not in st.session_state:
+        st.session_state.loop = asyncio.new_event_loop()
+    loop = st.session_state.loop
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
 
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+def cache_key(model: str, message: str, tools: Iterable[str], temperature: float) -> str:
+    """모델/메시지/도구 목록/온도를 정규화하여 sha256 캐시 키 생성"""
+    payload = json.dumps(
+        {
+            "model": model,
+            "message": message,
+            "tools": sorted(tools),
+            "temperature": temperature,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LRUCache:
+    """TTL이 있는 인메모리 LRU 캐시 (OrderedDict 기반)"""
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, value = entry
+        if time.monotonic() > expires:
+            # TTL 만료된 항목 제거
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SemanticCache:
+    """임베딩 코사인 유사도 기반 시맨틱 캐시
+
+    정규화된 임베딩을 (N, D) float32 행렬로 쌓아두고,
+    조회 시 행렬-벡터 곱 한 번으로 전체 유사도를 계산한다.
+    """
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        # (만료 시각, 쿼리, 최종 답변) — 행렬의 행 순서와 동일
+        self._entries: List[Tuple[float, str, str]] = []
+        self._matrix: Optional[np.ndarray] = None  # shape (N, D), 행 정규화됨
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _prune_expired(self):
+        now = time.monotonic()
+        alive = [i for i, (expires, _, _) in enumerate(self._entries) if expires > now]
+        if len(alive) != len(self._entries):
+            self._entries = [self._entries[i] for i in alive]
+            self._matrix = self._matrix[alive] if alive else None
+
+    def lookup(self, embedding: np.ndarray) -> Optional[str]:
+        """임계값 이상으로 유사한 캐시 항목의 최종 답변 반환 (없으면 None)"""
+        self._prune_expired()
+        if self._matrix is None:
+            self.misses += 1
+            return None
+        sims = self._matrix @ self._normalize(embedding)
+        best = int(np.argmax(sims))
+        if sims[best] >= self.threshold:
+            self.hits += 1
+            return self._entries[best][2]
+        self.misses += 1
+        return None
+
+    def add(self, embedding: np.ndarray, query: str, answer: str):
+        vec = self._normalize(embedding).reshape(1, -1)
+        self._entries.append((time.monotonic() + self.ttl, query, answer))
+        self._matrix = vec if self._matrix is None else np.vstack([self._matrix, vec])
+        if len(self._entries) > self.maxsize:
+            # 가장 오래된 항목부터 제거
+            drop = len(self._entries) - self.maxsize
+            self._entries = self._entries[drop:]
+            self._matrix = self._matrix[drop:]
+
+    def clear(self):
+        self._entries = []
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
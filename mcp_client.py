@@ -2,13 +2,19 @@ import asyncio
 import os
 import sys
 import json
-import traceback
+import logging
+import time
+import sqlite3
+import threading
+import difflib
+import hashlib
 from pathlib import Path
+from collections import OrderedDict
 from contextlib import AsyncExitStack
 from typing import Dict, List, Any, Optional
 
-# Windows 인코딩 문제 해결
-if sys.platform == 'win32':
+# Windows 인코딩 문제 해결 (이미 UTF-8이면 래퍼를 다시 씌우지 않음)
+if sys.platform == 'win32' and (sys.stdout.encoding or '').lower() not in ('utf-8', 'utf8'):
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
@@ -18,15 +24,68 @@ from mcp.client.stdio import stdio_client
 from mcp.client.sse import sse_client
 from mcp.types import CallToolResult, Tool
 
+logger = logging.getLogger("mcp_client")
+
+try:
+    import orjson
+except ImportError:  # orjson은 선택 의존성 — 없으면 표준 json 사용
+    orjson = None
+
+try:
+    from jsonschema import Draft7Validator
+except ImportError:  # jsonschema는 선택 의존성 — 없으면 스키마 검증 생략
+    Draft7Validator = None
+
+# CallToolResult content 타입별 포매터 — 분기 사다리 대신 dict 디스패치
+_FORMATTERS = {
+    "text": lambda c: c.text,
+    "image": lambda c: f"[Image: {c.mimeType}]",
+    "resource": lambda c: f"[Resource: {c.uri}]",
+}
+
 class MCPClientManager:
+    # 도구 결과 캐시 보관 한도
+    RESULT_CACHE_MAXSIZE = 256
+    # 세션 간에도 살아남는 디스크 캐시 파일
+    DISK_CACHE_PATH = ".mcp_cache.db"
+    # 지연 공개된 도구의 스키마를 조회하는 합성 메타 도구 이름
+    DISCOVER_TOOL_NAME = "discover_tool"
+    # 서버별 동시 도구 호출 기본 상한
+    DEFAULT_MAX_CONCURRENCY = 8
+    # 서버 연결 전체(전송 생성 + 세션 + initialize)에 대한 단일 제한 시간(초)
+    CONNECT_TIMEOUT_S = 60.0
+
     def __init__(self, config_path: Optional[str] = None):
         self.sessions: Dict[str, ClientSession] = {}
         self.exit_stack = AsyncExitStack()
         self.tools: List[Dict[str, Any]] = []
+        # 이름 → 도구 레코드 (call_tool의 선형 탐색 방지)
+        self._tool_index: Dict[str, Dict[str, Any]] = {}
+        # get_tools_for_gemini 결과 캐시 (도구 내용이 실제로 바뀔 때만 무효화)
+        self._gemini_tools: Optional[List[Dict[str, Any]]] = None
+        self._tools_hash: Optional[str] = None
         self._is_connected = False
         self.connection_errors: Dict[str, str] = {}
         self.config_path = config_path or "agent.mcp.json"
         self.mcp_config: Dict[str, Any] = {}
+        # 멱등 도구 결과 캐시: key → (만료 시각, 결과 문자열)
+        self._result_cache: OrderedDict[str, tuple] = OrderedDict()
+        self._cacheable: set = set()
+        self._deferred: set = set()
+        # 서버별 동시 호출 제한 — stdio 파이프/SSE 커넥터 포화로 인한 타임아웃 방지
+        self._server_sems: Dict[str, asyncio.Semaphore] = {}
+        # 동일 키 동시 호출 병합(single-flight): key → 진행 중인 Future
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tool_cache_ttl = 300.0
+        # 자식 프로세스용 환경 — 프로세스 수명 동안 불변이므로 1회만 복사,
+        # MCP 서버에 필요 없는 자격증명류 키는 제외
+        self._child_env = {
+            k: v for k, v in os.environ.items()
+            if not k.startswith(("AWS_", "GOOGLE_APPLICATION_"))
+        }
+        # 프로세스 재시작 후에도 유효한 디스크 캐시 (sqlite)
+        self._disk: Optional[sqlite3.Connection] = None
+        self._init_disk_cache()
         self._load_config()
     
     def _load_config(self):
@@ -34,18 +93,82 @@ class MCPClientManager:
         try:
             config_file = Path(self.config_path)
             if config_file.exists():
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    self.mcp_config = json.load(f)
-                print(f"[OK] Loaded MCP config from {self.config_path}")
+                # orjson은 bytes를 바로 파싱하므로 바이너리로 읽는다
+                with open(config_file, 'rb') as f:
+                    raw = f.read()
+                self.mcp_config = orjson.loads(raw) if orjson is not None else json.loads(raw)
+                logger.info("Loaded MCP config from %s", self.config_path)
+                # 결과 캐시 대상 도구 목록 (멱등 도구만 opt-in)
+                self._cacheable = set(self.mcp_config.get("cacheable_tools", []))
+                # 스키마를 매 턴 보내지 않고 요청 시에만 공개할 도구 목록
+                self._deferred = set(self.mcp_config.get("deferred_tools", []))
+                self._tool_cache_ttl = float(self.mcp_config.get("tool_cache_ttl", 300))
             else:
-                print(f"[WARN] Config file {self.config_path} not found, using default settings")
+                logger.warning("Config file %s not found, using default settings", self.config_path)
                 self.mcp_config = {}
         except Exception as e:
-            print(f"[ERROR] Error loading config file: {e}")
+            logger.error("Error loading config file: %s", e)
             self.mcp_config = {}
+        # 설정은 로드 후 불변이므로 stdio/SSE 분기도 여기서 한 번만 결정해 둔다
+        self._c7_config, self._c7_factory = self._build_c7_factory()
+
+    def _build_c7_factory(self):
+        """Context7 전송 팩토리를 설정 로드 시점에 미리 구성
+
+        command가 있으면 stdio, 아니면 SSE — 연결 시도마다 같은 분기를
+        다시 타지 않도록 (설정, 인자 없는 팩토리) 쌍을 반환한다.
+        """
+        mcp_servers = self.mcp_config.get("mcpServers", {})
+        c7_config = mcp_servers.get("context7") or mcp_servers.get("Context7", {})
+
+        if "command" in c7_config:
+            # Stdio 방식
+            c7_params = StdioServerParameters(
+                command=c7_config.get("command", "npx"),
+                args=c7_config.get("args", []),
+                env=self._child_env
+            )
+            return c7_config, lambda: stdio_client(c7_params)
+
+        # SSE 방식 (기존 방식, 하위 호환성)
+        sse_kwargs = {"url": c7_config.get("url", "https://mcp.context7.com/mcp")}
+        headers = c7_config.get("headers", {})
+        if headers:
+            sse_kwargs["headers"] = headers
+        return c7_config, lambda: sse_client(**sse_kwargs)
+
+    async def _try_one_ddg_config(self, config_name, ddg_config,
+                                  winner_decided: asyncio.Event):
+        """단일 DDG 설정으로 연결 시도 — 성공 시 (설정, 세션, 로컬 스택) 반환
+
+        리소스를 로컬 AsyncExitStack에 모아 두었다가 경쟁에서 이긴 쪽만
+        메인 exit_stack으로 옮긴다. anyio의 cancel scope는 들어간 태스크에서만
+        나갈 수 있으므로, 경쟁에서 진 쪽은 남의 태스크가 아니라 여기서
+        스스로 닫는다 (winner_decided 이벤트로 패배를 확인).
+        """
+        command = ddg_config.get("command", "npx")
+        args = ddg_config.get("args", ["-y", "duckduckgo-mcp-server"])
+        ddg_params = StdioServerParameters(
+            command=command,
+            args=args,
+            env=self._child_env
+        )
+        stack = AsyncExitStack()
+        try:
+            transport = await stack.enter_async_context(stdio_client(ddg_params))
+            session = await stack.enter_async_context(
+                ClientSession(transport[0], transport[1])
+            )
+            await session.initialize()
+            if winner_decided.is_set():
+                raise RuntimeError("lost connection race")
+        except BaseException:
+            await stack.aclose()
+            raise
+        return config_name, ddg_config, session, stack
 
     async def _connect_ddg(self):
-        """DuckDuckGo MCP 서버 연결 (Stdio)"""
+        """DuckDuckGo MCP 서버 연결 (Stdio) — 후보 설정들을 동시에 경쟁시킨다"""
         mcp_servers = self.mcp_config.get("mcpServers", {})
         
         # duckduckgo-search와 ddg-search 설정 모두 가져오기
@@ -62,129 +185,111 @@ class MCPClientManager:
         # 기본 설정
         if not configs_to_try:
             configs_to_try.append(("default", {"command": "npx", "args": ["-y", "duckduckgo-mcp-server"]}))
-        
-        # 각 설정을 순차적으로 시도
+
+        # 순차 폴백 대신 모든 설정을 동시에 시도하고 먼저 성공한 쪽을 쓴다 —
+        # 주 설정의 npx 부트스트랩이 느려도 60초를 통째로 날리지 않는다
+        logger.info("Attempting to connect to DuckDuckGo MCP server (%d configurations)...",
+                    len(configs_to_try))
+        task_names = {}
+        winner_decided = asyncio.Event()
         for config_name, ddg_config in configs_to_try:
-            try:
-                print(f"[INFO] Attempting to connect to DuckDuckGo MCP server using {config_name}...")
-                
-                command = ddg_config.get("command", "npx")
-                args = ddg_config.get("args", ["-y", "duckduckgo-mcp-server"])
-                
-                ddg_params = StdioServerParameters(
-                    command=command, 
-                    args=args,
-                    env=os.environ.copy()
-                )
-                
-                # 타임아웃 설정 (60초로 증가 - npx 설치 시간 고려)
-                ddg_transport = await asyncio.wait_for(
-                    self.exit_stack.enter_async_context(stdio_client(ddg_params)),
-                    timeout=60.0
-                )
-                
-                session = await asyncio.wait_for(
-                    self.exit_stack.enter_async_context(
-                        ClientSession(ddg_transport[0], ddg_transport[1])
-                    ),
-                    timeout=60.0
-                )
-                
-                await asyncio.wait_for(session.initialize(), timeout=60.0)
-                self.sessions["duckduckgo"] = session
-                print(f"[OK] Successfully connected to DuckDuckGo using {config_name}")
-                return True
-            except FileNotFoundError:
-                # 명령어를 찾을 수 없으면 다음 설정 시도
-                print(f"[WARN] Command '{command}' not found, trying next configuration...")
-                if config_name == configs_to_try[-1][0]:
-                    # 마지막 설정도 실패하면 에러
-                    error_msg = f"All DuckDuckGo configurations failed. Last error: Command '{command}' not found. Please install '{command}' or check PATH."
-                    print(f"[ERROR] {error_msg}")
-                    self.connection_errors["duckduckgo"] = error_msg
-                    return False
-                continue
-            except asyncio.TimeoutError:
-                # 타임아웃이면 다음 설정 시도
-                print(f"[WARN] Connection timeout with {config_name}, trying next configuration...")
-                if config_name == configs_to_try[-1][0]:
-                    error_msg = "Connection timeout (60s) - all configurations failed. Try running the command manually first."
-                    print(f"[ERROR] {error_msg}")
-                    self.connection_errors["duckduckgo"] = error_msg
-                    return False
-                continue
-            except Exception as e:
-                # 다른 에러면 다음 설정 시도
-                print(f"[WARN] Connection failed with {config_name}: {str(e)}, trying next configuration...")
-                if config_name == configs_to_try[-1][0]:
-                    error_msg = f"All DuckDuckGo configurations failed. Last error: {str(e)}"
-                    print(f"[ERROR] DuckDuckGo connection error: {error_msg}")
-                    self.connection_errors["duckduckgo"] = error_msg
-                    return False
-                continue
-        
-        return False
+            task = asyncio.ensure_future(
+                self._try_one_ddg_config(config_name, ddg_config, winner_decided)
+            )
+            task_names[task] = config_name
+        pending = set(task_names)
+        errors = {}
+        winner = None
+
+        try:
+            async with asyncio.timeout(self.CONNECT_TIMEOUT_S):
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        try:
+                            result = task.result()
+                        except Exception as e:
+                            errors[task_names[task]] = f"{type(e).__name__}: {e}"
+                            logger.warning("Connection failed with %s: %s", task_names[task], e)
+                            continue
+                        if winner is None:
+                            winner = result
+                            winner_decided.set()
+                        else:
+                            # 승자 결정과 동시에 완료된 잔여 성공분 — 이 스택은
+                            # 다른 태스크에서 열렸으므로 닫기 실패(cancel scope
+                            # 소유권)는 삼키고 승자 등록을 계속한다
+                            try:
+                                await result[3].aclose()
+                            except Exception as e:
+                                logger.warning(
+                                    "Could not close losing %s connection: %s",
+                                    task_names[task], e
+                                )
+        except asyncio.TimeoutError:
+            errors["timeout"] = f"Connection timeout ({int(self.CONNECT_TIMEOUT_S)}s)"
+
+        # 진 태스크 정리
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner is None:
+            error_msg = "All DuckDuckGo configurations failed: " + "; ".join(
+                f"{name}: {err}" for name, err in errors.items()
+            )
+            logger.error("DuckDuckGo connection error: %s", error_msg)
+            self.connection_errors["duckduckgo"] = error_msg
+            return False
+
+        config_name, ddg_config, session, stack = winner
+        # 승자의 리소스를 매니저 수명에 연결
+        await self.exit_stack.enter_async_context(stack)
+        self.sessions["duckduckgo"] = session
+        self._server_sems["duckduckgo"] = asyncio.Semaphore(
+            int(ddg_config.get("max_concurrency", self.DEFAULT_MAX_CONCURRENCY))
+        )
+        self._invalidate_server_cache("duckduckgo")
+        logger.info("Successfully connected to DuckDuckGo using %s", config_name)
+        return True
 
     async def _connect_context7(self):
         """Context7 MCP 서버 연결 (Stdio 또는 SSE)"""
         try:
-            print("[INFO] Attempting to connect to Context7 MCP server...")
-            
-            # config에서 설정 읽기 (대소문자 구분 없이 시도)
-            mcp_servers = self.mcp_config.get("mcpServers", {})
-            c7_config = mcp_servers.get("context7") or mcp_servers.get("Context7", {})
-            
-            # command가 있으면 stdio 방식, url이 있으면 SSE 방식
-            if "command" in c7_config:
-                # Stdio 방식
-                command = c7_config.get("command", "npx")
-                args = c7_config.get("args", [])
-                
-                c7_params = StdioServerParameters(
-                    command=command,
-                    args=args,
-                    env=os.environ.copy()
-                )
-                
-                c7_transport = await asyncio.wait_for(
-                    self.exit_stack.enter_async_context(stdio_client(c7_params)),
-                    timeout=60.0
-                )
-            else:
-                # SSE 방식 (기존 방식, 하위 호환성)
-                url = c7_config.get("url", "https://mcp.context7.com/mcp")
-                headers = c7_config.get("headers", {})
-                
-                sse_kwargs = {"url": url}
-                if headers:
-                    sse_kwargs["headers"] = headers
-                
-                c7_transport = await asyncio.wait_for(
-                    self.exit_stack.enter_async_context(
-                        sse_client(**sse_kwargs)
-                    ),
-                    timeout=60.0
+            logger.info("Attempting to connect to Context7 MCP server...")
+
+            # 전송 방식(stdio/SSE)은 _load_config에서 이미 결정되어 있다
+            c7_config = self._c7_config
+
+            # 단계별 타임아웃을 쌓지 않고 연결 전체에 60초 데드라인 하나만 적용
+            async with asyncio.timeout(self.CONNECT_TIMEOUT_S):
+                c7_transport = await self.exit_stack.enter_async_context(
+                    self._c7_factory()
                 )
-            
-            session = await asyncio.wait_for(
-                self.exit_stack.enter_async_context(
+                session = await self.exit_stack.enter_async_context(
                     ClientSession(c7_transport[0], c7_transport[1])
-                ),
-                timeout=60.0
-            )
-            
-            await asyncio.wait_for(session.initialize(), timeout=60.0)
+                )
+                await session.initialize()
+
             self.sessions["context7"] = session
-            print("[OK] Successfully connected to Context7")
+            self._server_sems["context7"] = asyncio.Semaphore(
+                int(c7_config.get("max_concurrency", self.DEFAULT_MAX_CONCURRENCY))
+            )
+            self._invalidate_server_cache("context7")
+            logger.info("Successfully connected to Context7")
             return True
         except asyncio.TimeoutError:
             error_msg = "Connection timeout (60s) - npx may be slow or network issue"
-            print(f"[ERROR] {error_msg}")
+            logger.error("%s", error_msg)
             self.connection_errors["context7"] = error_msg
             return False
         except Exception as e:
-            error_msg = f"Connection failed: {str(e)}\n{traceback.format_exc()}"
-            print(f"[ERROR] Context7 connection error: {error_msg}")
+            # 트레이스백 포매팅은 로거에 맡긴다 — 핸들러가 실제로 기록할 때만 비용 발생
+            error_msg = f"Connection failed: {type(e).__name__}: {str(e)}"
+            logger.exception("Context7 connection error")
             self.connection_errors["context7"] = error_msg
             return False
 
@@ -216,36 +321,83 @@ class MCPClientManager:
         # 연결 상태 확인
         if ddg_connected and c7_connected:
             self._is_connected = True
-            print("[OK] Connected to all MCP servers")
+            logger.info("Connected to all MCP servers")
         elif ddg_connected:
             self._is_connected = True
-            print("[WARN] Connected to DuckDuckGo only (Context7 failed)")
+            logger.warning("Connected to DuckDuckGo only (Context7 failed)")
         elif c7_connected:
             self._is_connected = True
-            print("[WARN] Connected to Context7 only (DuckDuckGo failed)")
+            logger.warning("Connected to Context7 only (DuckDuckGo failed)")
 
     async def refresh_tools(self):
-        self.tools = []
-        for name, session in self.sessions.items():
-            try:
-                result = await session.list_tools()
-                for tool in result.tools:
-                    self.tools.append({
-                        "name": tool.name,
-                        "description": tool.description,
-                        "input_schema": tool.inputSchema,
-                        "server": name
-                    })
-            except Exception as e:
-                print(f"Error listing tools for {name}: {e}")
+        self.clear_tool_cache()
+
+        # 서버별 list_tools를 병렬로 — 한 서버 실패가 나머지를 막지 않도록
+        names = list(self.sessions)
+        results = await asyncio.gather(
+            *(self.sessions[name].list_tools() for name in names),
+            return_exceptions=True
+        )
+        new_tools = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error("Error listing tools for %s: %s", name, result)
+                continue
+            for tool in result.tools:
+                # 스키마를 여기서 한 번만 검증/컴파일 — 잘못된 도구는 호출
+                # 시점이 아니라 목록 갱신 시점에 걸러낸다
+                validator = None
+                if Draft7Validator is not None:
+                    try:
+                        Draft7Validator.check_schema(tool.inputSchema)
+                        validator = Draft7Validator(tool.inputSchema)
+                    except Exception as e:
+                        logger.warning(
+                            "Dropping tool %s from %s: invalid input schema (%s)",
+                            tool.name, name, e
+                        )
+                        continue
+                new_tools.append({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "input_schema": tool.inputSchema,
+                    "server": name,
+                    "deferred": tool.name in self._deferred,
+                    "_validator": validator
+                })
+
+        # 재연결 후에도 선언 순서가 바이트 단위로 동일하도록 정렬
+        new_tools.sort(key=lambda t: (t["server"], t["name"]))
+        self.tools = new_tools
+        self._tool_index = {t["name"]: t for t in new_tools}
+
+        # 내용이 실제로 바뀐 경우에만 Gemini 선언 캐시 무효화 —
+        # 동일 바이트가 유지되어야 프로바이더 프롬프트 캐시가 적중한다
+        tools_hash = hashlib.md5(
+            json.dumps(
+                # 밑줄 키(컴파일된 validator 등)는 refresh마다 repr가 달라지므로 제외
+                [{k: v for k, v in t.items() if not k.startswith("_")} for t in new_tools],
+                sort_keys=True, default=str
+            ).encode()
+        ).hexdigest()
+        if tools_hash != self._tools_hash:
+            self._tools_hash = tools_hash
+            self._gemini_tools = None
 
     def get_tools_for_gemini(self) -> List[Dict[str, Any]]:
         """
         Convert MCP tools to Gemini function declarations format.
         Compatible with google-genai SDK.
         """
+        if self._gemini_tools is not None:
+            return self._gemini_tools
+
         gemini_tools = []
+        deferred = []
         for tool in self.tools:
+            if tool.get("deferred"):
+                deferred.append(tool)
+                continue
             # google-genai SDK expects a dict for function declaration
             gemini_tool = {
                 "name": tool["name"],
@@ -253,32 +405,295 @@ class MCPClientManager:
                 "parameters": tool["input_schema"]
             }
             gemini_tools.append(gemini_tool)
+
+        # 지연 공개 도구가 있으면 전체 스키마 대신 discover_tool 하나만 노출
+        if deferred:
+            listing = "; ".join(f"{t['name']} ({t['server']})" for t in deferred)
+            gemini_tools.append({
+                "name": self.DISCOVER_TOOL_NAME,
+                "description": (
+                    "Look up the full input schema of a deferred tool by name "
+                    "(fuzzy matched). Deferred tools can then be invoked via "
+                    f"execute_plan. Available: {listing}"
+                ),
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string", "description": "Tool name to look up"}
+                    },
+                    "required": ["name"]
+                }
+            })
+
+        self._gemini_tools = gemini_tools
         return gemini_tools
 
+    def _discover_tool(self, name: str) -> str:
+        """지연 공개 도구의 전체 정의 반환 (이름은 퍼지 매칭)"""
+        target = self._tool_index.get(name)
+        if target is None:
+            matches = difflib.get_close_matches(name, list(self._tool_index), n=1, cutoff=0.5)
+            if matches:
+                target = self._tool_index[matches[0]]
+        if target is None:
+            return f"Error: no tool matching '{name}'. Known tools: {', '.join(self._tool_index)}"
+        return json.dumps({
+            "name": target["name"],
+            "description": target["description"],
+            "input_schema": target["input_schema"],
+            "server": target["server"]
+        }, ensure_ascii=False)
+
+    def _init_disk_cache(self):
+        """디스크 캐시 초기화 — 실패해도 기능 저하 없이 인메모리만 사용"""
+        try:
+            # Streamlit은 rerun마다 새 스레드에서 스크립트를 실행하지만 접근은
+            # 단일 이벤트 루프로 직렬화되므로 스레드 검사를 끈다
+            self._disk = sqlite3.connect(self.DISK_CACHE_PATH, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            self._disk.commit()
+        except Exception as e:
+            logger.warning("Disk cache unavailable: %s", e)
+            self._disk = None
+
+    def _server_cache_ttl(self, server: str) -> float:
+        return float(
+            self.mcp_config.get("mcpServers", {}).get(server, {}).get("cache_ttl", self._tool_cache_ttl)
+        )
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if self._disk is None:
+            return None
+        try:
+            row = self._disk.execute(
+                "SELECT value, expires FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires < time.time():
+                self._disk.execute("DELETE FROM tool_cache WHERE key = ?", (key,))
+                self._disk.commit()
+                return None
+            return value
+        except Exception as e:
+            logger.warning("Disk cache read failed for %s: %s", key, e)
+            return None
+
+    def _disk_set(self, key: str, value: str, ttl: float):
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self._disk.commit()
+        except Exception as e:
+            logger.warning("Disk cache write failed for %s: %s", key, e)
+
+    def _invalidate_server_cache(self, server: str):
+        """재연결된 서버의 디스크 캐시 항목 무효화"""
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute("DELETE FROM tool_cache WHERE key LIKE ?", (f"{server}:%",))
+            self._disk.commit()
+        except Exception as e:
+            logger.warning("Disk cache invalidation failed for %s: %s", server, e)
+
+    @staticmethod
+    def _args_key(tool_name: str, arguments: dict) -> str:
+        """(도구 이름, 인자) 조합의 캐시 키 생성"""
+        if orjson is not None:
+            canonical = orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS)
+        else:
+            canonical = json.dumps(arguments, sort_keys=True, separators=(",", ":")).encode()
+        return f"{tool_name}:{hashlib.sha256(canonical).hexdigest()}"
+
+    def clear_tool_cache(self):
+        """도구 결과 캐시 비우기 (도구 목록 갱신/재연결 시 호출)"""
+        self._result_cache.clear()
+
     async def call_tool(self, tool_name: str, arguments: dict) -> Any:
-        target_tool = next((t for t in self.tools if t["name"] == tool_name), None)
+        # 합성 메타 도구는 서버로 보내지 않고 로컬에서 처리
+        if tool_name == self.DISCOVER_TOOL_NAME:
+            return self._discover_tool(str(arguments.get("name", "")))
+
+        target_tool = self._tool_index.get(tool_name)
         if not target_tool:
             raise ValueError(f"Tool {tool_name} not found")
-        
+
+        # 스키마 위반 인자는 서버 왕복 전에 로컬에서 거부 (마이크로초 단위)
+        validator = target_tool.get("_validator")
+        if validator is not None:
+            error = next(validator.iter_errors(arguments), None)
+            if error is not None:
+                raise ValueError(f"Invalid arguments for {tool_name}: {error.message}")
+
+        # 멱등으로 선언된 도구는 동일 인자 재호출 시 캐시에서 바로 반환
+        cache_key = None
+        disk_key = None
+        if tool_name in self._cacheable:
+            cache_key = self._args_key(tool_name, arguments)
+            entry = self._result_cache.get(cache_key)
+            if entry is not None:
+                expires, cached_output = entry
+                if expires > time.monotonic():
+                    self._result_cache.move_to_end(cache_key)
+                    return cached_output
+                del self._result_cache[cache_key]
+
+            # 인메모리 미스 → 디스크 캐시 확인 (콜드 스타트에서도 유효)
+            disk_key = f"{target_tool['server']}:{cache_key}"
+            cached_output = self._disk_get(disk_key)
+            if cached_output is not None:
+                self._result_cache[cache_key] = (
+                    time.monotonic() + self._tool_cache_ttl, cached_output
+                )
+                return cached_output
+
+            # 같은 호출이 이미 진행 중이면 결과를 공유 (single-flight)
+            existing = self._inflight.get(cache_key)
+            if existing is not None:
+                return await asyncio.shield(existing)
+
+        if cache_key is None:
+            return await self._dispatch_tool(target_tool, tool_name, arguments, cache_key, disk_key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            joined = await self._dispatch_tool(target_tool, tool_name, arguments, cache_key, disk_key)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            # 아무도 기다리지 않았다면 "never retrieved" 경고가 나지 않도록 소비
+            future.exception()
+            raise
+        else:
+            if not future.done():
+                future.set_result(joined)
+            return joined
+        finally:
+            # 취소(CancelledError)는 위의 except에 걸리지 않는다 — 어떤 경로로
+            # 빠져나가든 퓨처를 종결시켜 대기자가 영원히 매달리지 않게 한다
+            if not future.done():
+                future.cancel()
+            self._inflight.pop(cache_key, None)
+
+    async def _raw_call(self, target_tool: Dict[str, Any], tool_name: str,
+                        arguments: dict) -> CallToolResult:
+        """서버로의 실제 디스패치 (서버별 세마포어 적용)"""
         session = self.sessions[target_tool["server"]]
-        result: CallToolResult = await session.call_tool(tool_name, arguments)
+        semaphore = self._server_sems.get(target_tool["server"])
+        if semaphore is not None:
+            async with semaphore:
+                return await session.call_tool(tool_name, arguments)
+        return await session.call_tool(tool_name, arguments)
+
+    async def call_tool_stream(self, tool_name: str, arguments: dict):
+        """call_tool의 스트리밍 버전 — content 항목을 전체 조립 없이 하나씩 산출
+
+        대형 응답(여러 페이지 검색 결과, 라이브러리 문서 전체)을 전부
+        메모리에 모으기 전에 소비자가 처리를 시작할 수 있다.
+        결과 캐시/코얼레싱을 거치지 않으므로 캐시가 필요하면 call_tool을 쓴다.
+        """
+        if tool_name == self.DISCOVER_TOOL_NAME:
+            yield self._discover_tool(str(arguments.get("name", "")))
+            return
+
+        target_tool = self._tool_index.get(tool_name)
+        if not target_tool:
+            raise ValueError(f"Tool {tool_name} not found")
+
+        result = await self._raw_call(target_tool, tool_name, arguments)
+        if result.isError:
+            yield f"Error: {result.content}"
+            return
+        for content in result.content:
+            if content.type in _FORMATTERS:
+                yield _FORMATTERS[content.type](content)
+
+    async def _dispatch_tool(self, target_tool: Dict[str, Any], tool_name: str,
+                             arguments: dict, cache_key: Optional[str],
+                             disk_key: Optional[str]) -> str:
+        """실제 서버 디스패치 + 결과 조립 + 캐시 반영"""
+        result = await self._raw_call(target_tool, tool_name, arguments)
         
-        output = []
         if not result.isError:
-            for content in result.content:
-                if content.type == "text":
-                    output.append(content.text)
-                elif content.type == "image":
-                    output.append(f"[Image: {content.mimeType}]")
-                elif content.type == "resource":
-                     output.append(f"[Resource: {content.uri}]")
+            joined = "\n".join(
+                _FORMATTERS[content.type](content)
+                for content in result.content
+                if content.type in _FORMATTERS
+            )
         else:
-             output.append(f"Error: {result.content}")
+            joined = f"Error: {result.content}"
+
+        # 성공 결과만 캐시에 저장
+        if cache_key is not None and not result.isError:
+            self._result_cache[cache_key] = (time.monotonic() + self._tool_cache_ttl, joined)
+            while len(self._result_cache) > self.RESULT_CACHE_MAXSIZE:
+                self._result_cache.popitem(last=False)
+            self._disk_set(disk_key, joined, self._server_cache_ttl(target_tool["server"]))
+
+        return joined
 
-        return "\n".join(output)
+    async def ensure_connected(self):
+        """연결 보장 — 살아있는 세션은 그대로 두고 끊어진 것만 재연결
+
+        핸드셰이크(프로세스 spawn + npx 부트스트랩 + initialize) 비용을
+        요청마다 다시 내지 않도록, 가벼운 ping으로 생존만 확인한다.
+        """
+        if not self._is_connected:
+            await self.connect()
+            return
+
+        dead = []
+        for name, session in list(self.sessions.items()):
+            try:
+                await asyncio.wait_for(session.send_ping(), timeout=1.0)
+            except Exception:
+                dead.append(name)
+        if not dead:
+            return
+
+        logger.warning("Reconnecting dead MCP sessions: %s", ", ".join(dead))
+        for name in dead:
+            self.sessions.pop(name, None)
+            self._server_sems.pop(name, None)
+        if "duckduckgo" in dead:
+            await self._connect_ddg()
+        if "context7" in dead:
+            await self._connect_context7()
+        await self.refresh_tools()
 
     async def cleanup(self):
+        self.clear_tool_cache()
         await self.exit_stack.aclose()
         self.sessions.clear()
+        self._server_sems.clear()
         self.tools = []
+        self._tool_index.clear()
+        self._gemini_tools = None
+        self._tools_hash = None
         self._is_connected = False
+
+# 프로세스 전역 싱글턴 — 요청 핸들러 간에 세션을 따뜻하게 유지
+_manager: Optional[MCPClientManager] = None
+_manager_lock = threading.Lock()
+
+def get_manager(config_path: Optional[str] = None) -> MCPClientManager:
+    """프로세스 범위 MCPClientManager 싱글턴 반환
+
+    생성자는 await하지 않으므로 동기 함수로 두어 Streamlit의
+    @st.cache_resource 같은 동기 컨텍스트에서도 쓸 수 있다.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MCPClientManager(config_path)
+        return _manager